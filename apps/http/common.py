@@ -1,8 +1,31 @@
+import re
 import sys
 
+# sizes of http_client.py -n, same as `head -c`: a number, then "b" (512 bytes) or a
+# unit with no suffix or "iB" (powers of 1024) or "B" (powers of 1000), e.g. 10M, 5000kB.
+# mininet/common.py loads parse_size to estimate the run timeout
+SIZE_RE = re.compile(r"(\d+)(?:(b)|([kKmMGTPE])(iB|B)?)?")
+SIZE_POWERS = {"K": 1, "M": 2, "G": 3, "T": 4, "P": 5, "E": 6}
+
 
 def pemilog(val):
     """
     Print to stderr with prefix [PEMI]
     """
     print(f"[PEMI] {val}", file=sys.stderr)
+
+
+def parse_size(s):
+    """
+    Parse a size like "500k", "10M", "5000kB" or "1000" into bytes
+    """
+    m = SIZE_RE.fullmatch(s)
+    if m is None:
+        raise ValueError(f"invalid size: {s!r}")
+    num, blocks, unit, suffix = m.groups()
+    if blocks:
+        return int(num) * 512
+    if unit is None:
+        return int(num)
+    base = 1000 if suffix == "B" else 1024
+    return int(num) * base ** SIZE_POWERS[unit.upper()]
@@ -1,12 +1,23 @@
 import tempfile
-from common import pemilog
+from common import pemilog, parse_size
 import os
+import sys
+import shlex
+import subprocess
 import argparse
 
+WRITE_CHUNK = 1024 * 1024  # bytes of random data generated per write
 
-def print_and_run_cmd(cmd):
-    pemilog(cmd)
-    return os.system(cmd)
+
+def write_random(f, nbytes):
+    """
+    Fill the file with nbytes of random data, one chunk at a time to bound memory
+    """
+    while nbytes > 0:
+        n = min(nbytes, WRITE_CHUNK)
+        f.write(os.urandom(n))
+        nbytes -= n
+    f.flush()
 
 
 def run_client(args, base_command, http_flag):
@@ -15,40 +26,55 @@ def run_client(args, base_command, http_flag):
         fname = args.getfile
     else:
         f = tempfile.NamedTemporaryFile()
-        print_and_run_cmd(f"head -c {args.n} /dev/urandom > {f.name}")
+        write_random(f, parse_size(args.n))
+        # NamedTemporaryFile is 0600: let the unprivileged nginx workers read it
+        os.fchmod(f.fileno(), 0o644)
         fname = f.name
         print(f"Data Size: {args.n}")
     print(f"HTTP: {http_flag}")
 
-    cmd = f"{base_command} -o /tmp/pemidownload https://{args.addr}{fname} "
-    cmd += f"{http_flag} --insecure "
-    cmd += f"--max-time {args.timeout} "
-    cmd += f"2>>{args.stderr} "  # need stdout(contains result data)
-
-    # Run the command
-    pemilog(cmd)
-    if args.trials is None:
-        fmt = r"\n\n      time_connect:  %{time_connect}s\n   time_appconnect:  %{time_appconnect}s\ntime_starttransfer:  %{time_starttransfer}s\n                   ----------\n        time_total:  %{time_total}s\n\nexitcode: %{exitcode}\nresponse_code: %{response_code}\nsize_upload: %{size_upload}\nsize_download: %{size_download}\nerrormsg: %{errormsg}\n"
-        cmd += f'-w "{fmt}" '
-        os.system(f"eval '{cmd}'")
-    else:
-        fmt = r"%{time_connect}\\t%{time_appconnect}\\t%{time_starttransfer}\\t\\t%{time_total}\\t%{exitcode}\\t\\t%{response_code}\\t\\t%{size_upload}\\t\\t%{size_download}\\t%{errormsg}\\n"
-        cmd += f'-w "{fmt}" '
-        header = "time_connect\ttime_appconnect\ttime_starttransfer\ttime_total\texitcode\tresponse_code\tsize_upload\tsize_download\terrormsg"
-        # print immediately
-        print(header, flush=True)
-        for _ in range(args.trials):
-            os.system(f"eval '{cmd}'")
+    # options of one transfer; repeated after --next when reusing the connection
+    opts = ["-o", "/tmp/pemidownload", f"https://{args.addr}{fname}"]
+    opts += [http_flag, "--insecure"]
+    opts += ["--max-time", str(args.timeout)]
+    if args.tls_sessions is not None:
+        # curl loads tickets from the file and saves new ones on exit,
+        # so every trial after the first resumes the TLS session
+        opts += ["--ssl-sessions", args.tls_sessions]
+    env = dict(os.environ, RUST_LOG="info")
+
+    # need stdout(contains result data), stderr is appended to args.stderr
+    with open(args.stderr, "ab", buffering=0) as stderr_f:
+
+        def run_curl(argv):
+            pemilog(shlex.join(argv))
+            sys.stdout.flush()  # keep our prints before curl's output
+            subprocess.run(argv, stderr=stderr_f, env=env, check=False)
+
+        if args.trials is None:
+            fmt = r"\n\n      time_connect:  %{time_connect}s\n   time_appconnect:  %{time_appconnect}s\ntime_starttransfer:  %{time_starttransfer}s\n                   ----------\n        time_total:  %{time_total}s\n\nexitcode: %{exitcode}\nresponse_code: %{response_code}\nsize_upload: %{size_upload}\nsize_download: %{size_download}\nerrormsg: %{errormsg}\n"
+            opts += ["-w", fmt]
+            run_curl(base_command + opts)
+        else:
+            fmt = r"%{time_connect}\t%{time_appconnect}\t%{time_starttransfer}\t\t%{time_total}\t%{exitcode}\t\t%{response_code}\t\t%{size_upload}\t\t%{size_download}\t%{errormsg}\n"
+            opts += ["-w", fmt]
+            header = "time_connect\ttime_appconnect\ttime_starttransfer\ttime_total\texitcode\tresponse_code\tsize_upload\tsize_download\terrormsg"
+            # print immediately
+            print(header, flush=True)
+            if args.reuse_conn:
+                # one curl process for all trials, later transfers reuse the connection
+                run_curl(base_command + opts + (["--next"] + opts) * (args.trials - 1))
+            else:
+                for _ in range(args.trials):
+                    run_curl(base_command + opts)
 
 
 def run_tcp_client(args):
-    cmd = "RUST_LOG=info curl "
-    run_client(args, cmd, "--http2")
+    run_client(args, ["curl"], "--http2")
 
 
 def run_quic_client(args):
-    cmd = "RUST_LOG=info curl "
-    run_client(args, cmd, "--http3-only")
+    run_client(args, ["curl"], "--http3-only")
 
 
 if __name__ == "__main__":
@@ -77,6 +103,20 @@ if __name__ == "__main__":
     parser.add_argument(
         "-t", "--trials", type=int, default=1, help="Number of trials (default: 1)."
     )
+    parser.add_argument(
+        "--reuse-conn",
+        action="store_true",
+        default=False,
+        help="Run all trials in one curl process that reuses the connection, "
+        "so only the first trial pays the handshake (default: new connection per trial)",
+    )
+    parser.add_argument(
+        "--tls-sessions",
+        default=None,
+        metavar="FILE",
+        help="File to keep TLS session tickets in across trials, to resume "
+        "sessions instead of full handshakes (default: None, full handshake per trial)",
+    )
     parser.add_argument(
         "--getfile",
         default=None,  # is set, the args.n is ignored
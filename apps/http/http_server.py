@@ -5,17 +5,35 @@ Very simple HTTP server in python for logging requests
 Usage::
     ./server.py [<ip>]
 """
-from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import logging
 import os
+import errno
+import socket
 from common import pemilog
 import argparse
 
+SOCK_BUF_SIZE = 8 * 1024 * 1024  # bytes, SO_SNDBUF/SO_RCVBUF of each connection
+MAX_COPY_CHUNK = 128 * 1024  # bytes, largest buffer of the read/write fallback
+
 
 class S(BaseHTTPRequestHandler):
-    def _set_response(self):
+    # keep connections alive between requests (needs Content-Length on every response)
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # no Nagle delay, and buffers large enough for the emulated BDP
+        s = self.request
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF_SIZE)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF_SIZE)
+
+    def _set_response(self, content_length):
         self.send_response(200)
         self.send_header("Content-type", "text/html")
+        self.send_header("Content-Length", str(content_length))
         self.end_headers()
 
     def do_GET(self):
@@ -24,24 +42,75 @@ class S(BaseHTTPRequestHandler):
             str(self.path),
             str(self.headers).strip(),
         )
-        self.send_response(200)
-        # get file length
-        file_length = os.path.getsize(self.path)
-        self.send_header("Content-Length", str(file_length))
-        self.send_header("Content-Type", "application/octet-stream")
-        self.send_header(
-            "Content-Disposition",
-            'attachment; filename="{}"'.format(os.path.basename(self.path)),
-        )
-        self.end_headers()
-        pemilog(f"GET request for {self.path}, length {file_length}")
+        # open once and stat the fd: no extra stat calls and no exists/open race
+        fd = None
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+            f = os.fdopen(fd, "rb", buffering=0)
+        except OSError as e:
+            # e.g. a directory: os.open succeeds but fdopen fails, and keeps the fd
+            if fd is not None:
+                os.close(fd)
+            if isinstance(e, FileNotFoundError):
+                pemilog(f"File not found: {self.path}")
+                self.send_error(404, "File not found")
+            else:
+                pemilog(f"Can't open {self.path}: {e}")
+                self.send_error(403, "Forbidden")
+            return
+        with f:
+            file_length = os.fstat(fd).st_size
+            self.send_response(200)
+            self.send_header("Content-Length", str(file_length))
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header(
+                "Content-Disposition",
+                'attachment; filename="{}"'.format(os.path.basename(self.path)),
+            )
+            self.end_headers()
+            pemilog(f"GET request for {self.path}, length {file_length}")
+            try:
+                self.send_file(f, file_length)
+            except Exception as e:
+                print(str(e))
+                self.close_connection = True  # body is incomplete
+
+    def send_file(self, f, file_length):
+        """
+        Send the file to the client with os.sendfile (zero-copy).
+        Fall back to read/write if the socket does not support sendfile (EINVAL).
+        """
+        self.wfile.flush()  # headers must go out before the body
+        out_fd = self.wfile.fileno()
+        in_fd = f.fileno()
+        offset = 0
         try:
-            if not os.path.exists(self.path):
-                raise Exception(f"File not found: {self.path}")
-            with open(self.path, "rb") as f:
-                self.wfile.write(f.read())
-        except Exception as e:
-            print(str(e))
+            while offset < file_length:
+                sent = os.sendfile(out_fd, in_fd, offset, file_length - offset)
+                if sent == 0:
+                    break  # file truncated while sending
+                offset += sent
+        except OSError as e:
+            if e.errno != errno.EINVAL or offset != 0:
+                raise
+            self.copy_file(f, file_length)
+
+    def copy_file(self, f, file_length):
+        """
+        Send the file in chunks of the socket send buffer size (at most MAX_COPY_CHUNK),
+        reusing one buffer.
+        """
+        sndbuf = self.connection.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        chunk_size = min(sndbuf, MAX_COPY_CHUNK)
+        buf = bytearray(chunk_size)
+        mv = memoryview(buf)
+        remaining = file_length
+        while remaining > 0:
+            n = f.readinto(buf)
+            if not n:
+                break
+            self.wfile.write(mv[:n])
+            remaining -= n
 
     def do_POST(self):
         content_length = int(
@@ -55,11 +124,18 @@ class S(BaseHTTPRequestHandler):
             len(post_data),
         )
 
-        self._set_response()
-        self.wfile.write("POST request for {}".format(self.path).encode("utf-8"))
+        body = "POST request for {}".format(self.path).encode("utf-8")
+        self._set_response(len(body))
+        self.wfile.write(body)
+
+
+class Server(ThreadingHTTPServer):
+    allow_reuse_address = True
+    request_queue_size = 128  # listen backlog
+    daemon_threads = True  # don't wait for keep-alive connections on exit
 
 
-def run(server_class=HTTPServer, handler_class=S, port=2222, ip=""):
+def run(server_class=Server, handler_class=S, port=2222, ip=""):
     logging.basicConfig(level=logging.DEBUG)
     server_address = (ip, port)
     httpd = server_class(server_address, handler_class)
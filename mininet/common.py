@@ -1,5 +1,8 @@
+import importlib.util
+import os
 import sys
 import time
+from inotify_simple import INotify, flags
 
 
 # Disable segmentation offloading on all hosts in the Mininet network
@@ -32,11 +35,11 @@ def popen(host, cmd):
     Run a command on a Mininet host and print its output.
     """
     p = host.popen(cmd.split(" "))
-    exitcode = p.wait()
-    for line in p.stderr:
-        sys.stderr.buffer.write(line)
-    for line in p.stdout:
-        sys.stdout.buffer.write(line)
+    # read both pipes while waiting, so a chatty child can't block on a full pipe
+    out, err = p.communicate()
+    exitcode = p.returncode
+    sys.stderr.buffer.write(err)
+    sys.stdout.buffer.write(out)
     sys.stderr.buffer.flush()
     sys.stdout.buffer.flush()
     if exitcode != 0:
@@ -46,49 +49,104 @@ def popen(host, cmd):
         exit(1)
 
 
+def run_chain(host, cmds):
+    """
+    Run commands on a Mininet host as one "cmd1 && cmd2 && ..." shell exec and
+    print its output. Exits on the first failing command, like popen.
+    """
+    chain = " && ".join(cmds)
+    out = host.cmd(f"{chain}; echo $?").rstrip()
+    out, _, exitcode = out.rpartition("\n")
+    exitcode = int(exitcode)
+    if out:
+        print(out, flush=True)
+    if exitcode != 0:
+        print(f"{host}({chain}) = {exitcode}")
+        sys.stderr.buffer.write(b"\n")
+        sys.stderr.buffer.flush()
+        exit(1)
+
+
+def wait_for_log(log_file, marker, timeout=30):
+    """
+    Wait until marker appears in log_file, or raise TimeoutError.
+    Wakes up on inotify events of the log directory and only reads the new bytes.
+    """
+    deadline = time.time() + timeout
+    marker = marker.encode()
+    offset = 0
+    tail = b""  # end of the last read, in case the marker is split between reads
+    with INotify() as inotify:
+        inotify.add_watch(os.path.dirname(log_file) or ".", flags.MODIFY | flags.CREATE)
+        while True:
+            try:
+                with open(log_file, "rb") as f:
+                    if os.fstat(f.fileno()).st_size < offset:
+                        offset, tail = 0, b""  # truncated (re-created) by a new run
+                    f.seek(offset)
+                    data = tail + f.read()
+                    offset = f.tell()
+                if marker in data:
+                    return
+                tail = data[-(len(marker) - 1) :]
+            except FileNotFoundError:
+                pass  # file not created yet
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"{marker.decode()!r} not found in {log_file} within {timeout} seconds."
+                )
+            inotify.read(timeout=int(remaining * 1000) + 1)
+
+
 def check_cap_start(log_file, tool="tcpdump", timeout=10):
     """
     Check whether the packet capture has started by monitoring the log file.
     """
-    start_time = time.time()
     start_sign = {
         "tcpdump": "listening on",
         "tshark": "Capturing on",
+        "dumpcap": "Capturing on",
     }
-    while True:
-        if time.time() - start_time > timeout:
-            raise TimeoutError(
-                f"{tool} did not start capturing within {timeout} seconds."
-            )
-        try:
-            with open(log_file, "r") as f:
-                if start_sign[tool] in f.read():
-                    break
-        except FileNotFoundError:
-            pass  # file not created yet
-        time.sleep(0.1)
+    try:
+        wait_for_log(log_file, start_sign[tool], timeout)
+    except TimeoutError:
+        raise TimeoutError(
+            f"{tool} did not start capturing within {timeout} seconds."
+        ) from None
+
+
+def load_module(name, path):
+    """
+    Import the Python file at path as module name.
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# parse_size of http_client.py -n. apps/http has its own common.py, so load it by path
+HTTP_COMMON = load_module(
+    "http_common",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../apps/http/common.py"),
+)
 
 
 def estimate_timeout(n, quic, loss):
     """
     Timeout is linear in the data size, larger if
     the client uses HTTP/3 instead of HTTP/1.1, larger when there is more loss,
-    and has a floor of 15 seconds. Otherwise defaults to 5 minutes. Timeout is
-    measured in seconds.
+    and has a floor of 15 seconds. Timeout is measured in seconds.
+    n is a size like "500k", "10M" or a plain number of bytes, as http_client.py -n;
+    raises ValueError if malformed.
     """
-    try:
-        if "k" in n:
-            kb = int(n[:-1])
-        elif "M" in n:
-            kb = int(n[:-1]) * 1000
-        scale = 0.01
-        if quic:
-            scale *= 4
-        if float(loss) > 1:
-            scale *= float(loss) / 1.5
-        return max(int(scale * kb), 15)
-    except:
-        return 300
+    kb = HTTP_COMMON.parse_size(n) / 1000
+    scale = 0.04 if quic else 0.01
+    loss = float(loss)
+    if loss > 1:
+        scale *= loss / 1.5
+    return max(int(scale * kb), 15)
 
 
 def get_max_queue_size_bytes(rtt_ms, bw_mbitps):
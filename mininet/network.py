@@ -1,8 +1,10 @@
 from mininet.net import Mininet
 from mininet.link import TCLink
-import time
 import os
+import subprocess
 import multiprocessing
+import time
+import functools
 import tomli
 from common import *
 
@@ -11,6 +13,15 @@ USER_NAME = "xxxx"  # your username on the system to run mahimahi
 WAIT_MM_INIT = 3  # seconds. Wait for mahimahi to initialize.
 
 
+@functools.lru_cache(maxsize=8)
+def load_mm_config(path, mtime):
+    """
+    Parse a Mahimahi TOML config. mtime is part of the cache key, so an edited file is re-read.
+    """
+    with open(path, "rb") as f:
+        return tomli.load(f)
+
+
 class PEMINetwork:
     def __init__(
         self,
@@ -26,8 +37,8 @@ class PEMINetwork:
         loss_seed=None,
     ):
         if mm_config is not None:
-            os.system(
-                "sudo sysctl -w net.ipv4.ip_forward=1"
+            subprocess.run(
+                ["sudo", "sysctl", "-w", "net.ipv4.ip_forward=1"]
             )  # need forward for mahimahi
 
         self.net = Mininet(controller=None, link=TCLink)
@@ -36,6 +47,7 @@ class PEMINetwork:
         self.h1 = self.net.addHost("h1", ip=ip(1), mac=mac(1))  # client
         self.h2 = self.net.addHost("h2", ip=ip(2), mac=mac(2))  # server
         self.r1 = self.net.addHost("r1")
+        self.cap_pids = []  # (host, pid) of the running dumpcap processes
 
         # Add links
         self.net.addLink(self.r1, self.h1)
@@ -52,7 +64,7 @@ class PEMINetwork:
 
         # Load Mahimahi config from TOML file if provided.
         if mm_config is not None:
-            mm_cfg = tomli.load(open(mm_config, "rb"))
+            mm_cfg = load_mm_config(mm_config, os.path.getmtime(mm_config))
             self.disable_tc_client = mm_cfg.get("disable_tc_client", False)
 
             if mm_cfg["mm_bin"] == "cell":
@@ -92,12 +104,17 @@ class PEMINetwork:
         self.loss_seed = loss_seed
 
         # Configure interfaces
-        popen(self.r1, "ifconfig r1-eth0 0")
-        popen(self.r1, "ifconfig r1-eth1 0")
-        popen(self.r1, "ifconfig r1-eth0 hw ether 00:00:00:00:01:01")
-        popen(self.r1, "ifconfig r1-eth1 hw ether 00:00:00:00:01:02")
-        popen(self.r1, "ip addr add 10.0.1.1/24 brd + dev r1-eth0")
-        popen(self.r1, "ip addr add 10.0.2.1/24 brd + dev r1-eth1")
+        run_chain(
+            self.r1,
+            [
+                "ifconfig r1-eth0 0",
+                "ifconfig r1-eth1 0",
+                "ifconfig r1-eth0 hw ether 00:00:00:00:01:01",
+                "ifconfig r1-eth1 hw ether 00:00:00:00:01:02",
+                "ip addr add 10.0.1.1/24 brd + dev r1-eth0",
+                "ip addr add 10.0.2.1/24 brd + dev r1-eth1",
+            ],
+        )
         self.r1.cmd("echo 1 > /proc/sys/net/ipv4/ip_forward")
         popen(self.h1, "ip route add default via 10.0.1.1")  # client
         popen(self.h2, "ip route add default via 10.0.2.1")  # server
@@ -131,69 +148,64 @@ class PEMINetwork:
 
         # Configure link latency, delay, bandwidth, and queue size
 
+        # computed once for all interfaces
+        netem_seed = f" seed {self.loss_seed}" if self.loss_seed is not None else ""
+        red_limit = bdp * 4
+
+        # commands of each qdisc for one interface; netem: "netem loss ... delay ..."
+        def tbf_cmds(iface, netem, bw):
+            return [
+                f"tc qdisc add dev {iface} root handle 1:0 {netem}",
+                f"tc qdisc add dev {iface} parent 1:1 handle 10: "
+                f"tbf rate {bw}mbit burst {bw*500*2} limit {bdp}",
+            ]
+
+        def cake_cmds(iface, netem, bw):
+            return [
+                f"tc qdisc add dev {iface} root handle 1:0 {netem}",
+                f"tc qdisc add dev {iface} parent 1:1 handle 10: "
+                f"cake bandwidth {bw}mbit"
+                f"oceanic flowblind besteffort",
+            ]
+
+        def codel_cmds(iface, netem, bw):
+            return [
+                f"tc qdisc add dev {iface} root handle 1:0 {netem} rate {bw}mbit",
+                f"tc qdisc add dev {iface} parent 1:1 handle 10: codel",
+            ]
+
+        def red_cmds(iface, netem, bw):
+            return [
+                f"tc qdisc add dev {iface} handle 1:0 root "
+                f"red limit {red_limit} avpkt 1000 adaptive "
+                f"harddrop bandwidth {bw}Mbit",
+                f"tc qdisc add dev {iface} parent 1:1 handle 10: {netem} rate {bw}mbit",
+            ]
+
+        def grenville_cmds(iface, netem, bw):
+            return [
+                f"tc qdisc add dev {iface} root handle 2: {netem}",
+                f"tc qdisc add dev {iface} parent 2: handle 3: htb default 10",
+                f"tc class add dev {iface} parent 3: classid 10 htb rate {bw}Mbit",
+                f"tc qdisc add dev {iface} parent 3:10 handle 11: "
+                f"red limit {red_limit} avpkt 1000 adaptive harddrop bandwidth {bw}Mbit",
+            ]
+
+        qdisc_cmds = {
+            "tbf": tbf_cmds,
+            "cake": cake_cmds,
+            "codel": codel_cmds,
+            "red": red_cmds,
+            "grenville": grenville_cmds,
+        }.get(qdisc)
+
         def tc(host, iface, loss_set, delay, bw):
-            netem_seed = f" seed {self.loss_seed}" if self.loss_seed is not None else ""
-            if qdisc == "tbf":
-                popen(
-                    host,
-                    f"tc qdisc add dev {iface} root handle 1:0 "
-                    f"netem loss {loss_set}{netem_seed} delay {delay}ms",
-                )
-                popen(
-                    host,
-                    f"tc qdisc add dev {iface} parent 1:1 handle 10: "
-                    f"tbf rate {bw}mbit burst {bw*500*2} limit {bdp}",
-                )
-            elif qdisc == "cake":
-                popen(
-                    host,
-                    f"tc qdisc add dev {iface} root handle 1:0 "
-                    f"netem loss {loss_set}{netem_seed} delay {delay}ms",
-                )
-                popen(
-                    host,
-                    f"tc qdisc add dev {iface} parent 1:1 handle 10: "
-                    f"cake bandwidth {bw}mbit"
-                    f"oceanic flowblind besteffort",
-                )
-            elif qdisc == "codel":
-                popen(
-                    host,
-                    f"tc qdisc add dev {iface} root handle 1:0 "
-                    f"netem loss {loss_set}{netem_seed} delay {delay}ms rate {bw}mbit",
-                )
-                popen(host, f"tc qdisc add dev {iface} parent 1:1 handle 10: codel")
-            elif qdisc == "red":
-                popen(
-                    host,
-                    f"tc qdisc add dev {iface} handle 1:0 root "
-                    f"red limit {bdp*4} avpkt 1000 adaptive "
-                    f"harddrop bandwidth {bw}Mbit",
-                )
-                popen(
-                    host,
-                    f"tc qdisc add dev {iface} parent 1:1 handle 10: "
-                    f"netem loss {loss_set}{netem_seed} delay {delay}ms rate {bw}mbit",
-                )
-            elif qdisc == "grenville":
-                popen(
-                    host,
-                    f"tc qdisc add dev {iface} root handle 2: netem loss {loss_set}{netem_seed} delay {delay}ms",
-                )
-                popen(
-                    host, f"tc qdisc add dev {iface} parent 2: handle 3: htb default 10"
-                )
-                popen(
-                    host,
-                    f"tc class add dev {iface} parent 3: classid 10 htb rate {bw}Mbit",
-                )
-                popen(
-                    host,
-                    f"tc qdisc add dev {iface} parent 3:10 handle 11: "
-                    f"red limit {bdp*4} avpkt 1000 adaptive harddrop bandwidth {bw}Mbit",
-                )
-            else:
+            if qdisc_cmds is None:
                 pemilog("{} {} no qdisc enabled".format(host, iface))
+                return
+            netem = f"netem loss {loss_set}{netem_seed} delay {delay}ms"
+            # one shell exec per interface instead of one per tc command
+            run_chain(host, qdisc_cmds(iface, netem, bw))
 
         if not self.disable_tc_client:
             if loss1ge is None:
@@ -219,8 +231,8 @@ class PEMINetwork:
         if self.net is not None:
             self.net.stop()
         if self.client_mm_prefix != "":
-            os.system(
-                "sudo sysctl -w net.ipv4.ip_forward=0"
+            subprocess.run(
+                ["sudo", "sysctl", "-w", "net.ipv4.ip_forward=0"]
             )  # disable forward after use mahimahi
 
     def init_arp(self):
@@ -283,8 +295,8 @@ class PEMINetwork:
         # make sure the icmp can be used by the pemi
         self.r1.cmdPrint(f'sudo sysctl -w net.ipv4.ping_group_range="0 2147483647"')
         self.r1.cmd(f"kill $(pidof pemi)")
-        # clear the log file
-        self.h2.cmd("rm -f r1.log")
+        # clear the log file, so an old "listening on" can't match
+        open("r1.log", "wb").close()
         # log_level = "error"
         proxy_only = ""  # default not set, and the proxy-only will be closed
         if pemi_proxy_only:
@@ -294,14 +306,7 @@ class PEMINetwork:
         pemilog(cmd)
         self.r1.cmd(cmd)
         # wait start
-        while True:
-            try:
-                with open("r1.log", "r") as f:
-                    if "listening on" in f.read():
-                        return
-            except FileNotFoundError:
-                pass  # file not created yet
-            time.sleep(0.1)
+        wait_for_log("r1.log", "listening on")
 
     def start_webserver(self):
         pemilog("Starting the NGINX/Python webserver on h2...")
@@ -315,14 +320,7 @@ class PEMINetwork:
         nginx_conf = current_dir + "/apps/http/nginx.conf"
         self.h2.cmdPrint(f"nginx -c {nginx_conf}")
         self.h2.cmdPrint(f"python3 apps/http/http_server.py &> s1.log &")
-        while True:
-            try:
-                with open("s1.log", "r") as f:
-                    if "Starting httpd" in f.read():
-                        return
-            except FileNotFoundError:
-                pass  # file not created yet
-            time.sleep(0.1)
+        wait_for_log("s1.log", "Starting httpd")
 
     def start_quiche_rtc_server(self, log_level, start_time):
         """
@@ -334,14 +332,7 @@ class PEMINetwork:
         self.h2.cmdPrint(
             f"RUST_LOG={log_level} ./target/release/rtc_server -s {start_time} -p {self.h2.IP()}:4433 &> s1.log &"
         )
-        while True:
-            try:
-                with open("s1.log", "r") as f:
-                    if "Listening on" in f.read():
-                        return
-            except FileNotFoundError:
-                pass  # file not created yet
-            time.sleep(0.1)
+        wait_for_log("s1.log", "Listening on")
 
     def start_quiche_rtc_client(self, log_level, start_time, video_long=10):
         frames = 30 * video_long
@@ -360,14 +351,7 @@ class PEMINetwork:
         self.h2.cmdPrint(
             f"RUST_LOG={log_level} ./apps/quinn-apps/target/release/quinn-goodput-server ./ --listen {self.h2.IP()}:4433 &> s1.log &"
         )
-        while True:
-            try:
-                with open("s1.log", "r") as f:
-                    if "Listening on" in f.read():
-                        return
-            except FileNotFoundError:
-                pass  # file not created yet
-            time.sleep(0.1)
+        wait_for_log("s1.log", "Listening on")
 
     def start_quinn_goodput_client(self, log_level, request_kb=10):
         pemilog("Starting the client on h1...")
@@ -385,14 +369,7 @@ class PEMINetwork:
         self.h2.cmdPrint(
             f"RUST_LOG={log_level} ./apps/quinn-apps/target/release/quinn-rtc-server --listen {self.h2.IP()}:4433 &> s1.log &"
         )
-        while True:
-            try:
-                with open("s1.log", "r") as f:
-                    if "Listening on" in f.read():
-                        return
-            except FileNotFoundError:
-                pass  # file not created yet
-            time.sleep(0.1)
+        wait_for_log("s1.log", "Listening on")
 
     def start_quinn_rtc_client(self, log_level, video_long=10):
         frames = 30 * video_long
@@ -411,14 +388,7 @@ class PEMINetwork:
         self.h2.cmdPrint(
             f"./apps/quicgo-apps/quic-go-goodput/server/server -p {self.h2.IP()}:4433 &> s1.log &"
         )
-        while True:
-            try:
-                with open("s1.log", "r") as f:
-                    if "running on" in f.read():
-                        return
-            except FileNotFoundError:
-                pass  # file not created yet
-            time.sleep(0.1)
+        wait_for_log("s1.log", "running on")
 
     def start_quicgo_goodput_client(self, log_level, request_kb=10):
         pemilog("Starting the client on h1...")
@@ -436,14 +406,7 @@ class PEMINetwork:
         self.h2.cmdPrint(
             f"./apps/quicgo-apps/quic-go-rtc/server/server -p {self.h2.IP()}:4433 &> s1.log &"
         )
-        while True:
-            try:
-                with open("s1.log", "r") as f:
-                    if "running on" in f.read():
-                        return
-            except FileNotFoundError:
-                pass  # file not created yet
-            time.sleep(0.1)
+        wait_for_log("s1.log", "running on")
 
     def start_quicgo_rtc_client(self, log_level, video_long=10):
         frames = 30 * video_long
@@ -461,26 +424,61 @@ class PEMINetwork:
         os.makedirs(pcap_dir, exist_ok=True)
         self.h1.cmd(f"rm -f {pcap_dir}/h1-eth0.pcap cap_h1.log")
         self.h2.cmd(f"rm -f {pcap_dir}/h2-eth0.pcap cap_h2.log")
-        self.r1.cmd(f"rm -f {pcap_dir}/r1-eth0.pcap cap_r1.log")
-        self.r1.cmd(f"rm -f {pcap_dir}/r1-eth1.pcap cap_r1-eth1.log")
+        self.r1.cmd(
+            f"rm -f {pcap_dir}/r1.pcapng {pcap_dir}/r1-eth0.pcap {pcap_dir}/r1-eth1.pcap cap_r1.log"
+        )
         # start capturing
         cap_filter = f"ip host {self.h1.IP()} and ip host {self.h2.IP()}"
         # if args.pemi or args.pep:
         #     cap_filter = f""  # remove all rules if the addr change
-        self.h1.cmd(
-            f"tshark -i h1-eth0 -f '{cap_filter}' -w {pcap_dir}/h1-eth0.pcap &> cap_h1.log &"
-        )
-        self.h2.cmd(
-            f"tshark -i h2-eth0 -f '{cap_filter}' -w {pcap_dir}/h2-eth0.pcap &> cap_h2.log &"
-        )
+        # dumpcap only writes packets (no dissection like tshark), with a 64 MiB
+        # kernel buffer to avoid drops at high packet rates. Keep full packets:
+        # tools/analyze_pcap.py needs the whole UDP payload and frame size.
+        dumpcap = f"dumpcap -B 64 -f '{cap_filter}'"
+        # Mininet keeps the $! of a command ending with "&" in lastPid
+        self.h1.cmd(f"{dumpcap} -i h1-eth0 -w {pcap_dir}/h1-eth0.pcap &> cap_h1.log &")
+        self.cap_pids.append((self.h1, self.h1.lastPid))
+        self.h2.cmd(f"{dumpcap} -i h2-eth0 -w {pcap_dir}/h2-eth0.pcap &> cap_h2.log &")
+        self.cap_pids.append((self.h2, self.h2.lastPid))
+        # one process for both r1 interfaces: pcapng keeps the interface of each packet,
+        # split into per-interface files by stop_capture
         self.r1.cmd(
-            f"tshark -i r1-eth0 -f '{cap_filter}' -w {pcap_dir}/r1-eth0.pcap &> cap_r1.log &"
-        )
-        self.r1.cmd(
-            f"tshark -i r1-eth1 -f '{cap_filter}' -w {pcap_dir}/r1-eth1.pcap &> cap_r1-eth1.log &"
+            f"{dumpcap} -i r1-eth0 -i r1-eth1 -w {pcap_dir}/r1.pcapng &> cap_r1.log &"
         )
+        self.cap_pids.append((self.r1, self.r1.lastPid))
         # wait the capture to start
-        check_cap_start("cap_r1.log", "tshark")
-        check_cap_start("cap_h1.log", "tshark")
-        check_cap_start("cap_h2.log", "tshark")
-        check_cap_start("cap_r1-eth1.log", "tshark")
+        check_cap_start("cap_r1.log", "dumpcap")
+        check_cap_start("cap_h1.log", "dumpcap")
+        check_cap_start("cap_h2.log", "dumpcap")
+
+    def stop_capture(self, timeout=10):
+        """
+        Stop the dumpcap processes started by start_capture and split the r1 capture
+        into r1-eth0.pcap and r1-eth1.pcap. A dumpcap still running after timeout
+        seconds is killed.
+        """
+        if not self.cap_pids:
+            return
+        pcap_dir = "pcap"
+        # SIGINT lets dumpcap flush its files
+        for host, pid in self.cap_pids:
+            host.cmd(f"kill -INT {pid}")
+        deadline = time.time() + timeout
+        for host, pid in self.cap_pids:
+            while host.cmd(f"kill -0 {pid} 2> /dev/null && echo running").strip():
+                if time.time() > deadline:
+                    pemilog(
+                        f"[Warning] dumpcap {pid} on {host} did not exit, killing it"
+                    )
+                    host.cmd(f"kill -KILL {pid}")
+                    break
+                time.sleep(0.1)
+        self.cap_pids = []
+        run_chain(
+            self.r1,
+            [
+                f"tshark -r {pcap_dir}/r1.pcapng -Y 'frame.interface_name == \"{iface}\"' "
+                f"-F pcap -w {pcap_dir}/{iface}.pcap"
+                for iface in ["r1-eth0", "r1-eth1"]
+            ],
+        )
@@ -3,6 +3,11 @@ Process RTC frame logs to compute frame-level statistics (frame-level jitter, fr
 """
 
 import os
+import re
+import mmap
+import shutil
+import numpy as np
+from scipy.signal import lfilter
 
 
 def save_frame_log(
@@ -12,85 +17,74 @@ def save_frame_log(
     save content of client_log, server_log to the result file
     if append is False, overwrite the output_file.
     """
-    with open(client_log) as client_f, open(server_log) as server_f, open(
-        output_file, "a" if append else "w"
+    with open(client_log, "rb") as client_f, open(server_log, "rb") as server_f, open(
+        output_file, "ab" if append else "wb"
     ) as result_f:
-        for line in server_f:
-            result_f.write(line)
-        for line in client_f:
-            result_f.write(line)
+        shutil.copyfileobj(server_f, result_f, 1 << 20)
+        shutil.copyfileobj(client_f, result_f, 1 << 20)
+
+
+# example1: RTC Server GetN request: 300 frames
+# example2: RTC Server GetN request: 300 frames, each is 12500 B
+SERVER_GETN_RE = re.compile(rb"RTC Server GetN request: (\d+) frames")
+# example: GetN request: 300 frames( 10 seconds)
+CLIENT_GETN_RE = re.compile(rb"^[^\n]*GetN request:[^\n]*?(\d+) seconds[^\n]*$", re.M)
+# example1: frame 6, sent time: 420.885449 (server)
+# example2: frame 1, fin time: 287.208894 (client)
+FRAME_LINE = rb"[ \t]*frame (\d+), (?:sent|fin) time: (\S+)[ \t\r]*(?:\n|\Z)"
+FRAME_RE = re.compile(rb"^" + FRAME_LINE, re.M)
+APP_ERR = b"Application error 0x0 (remote)"
+# a run of frame lines; on the client, app error lines may be mixed in
+SERVER_BLOCK_RE = re.compile(rb"(?:" + FRAME_LINE + rb")*")
+CLIENT_BLOCK_RE = re.compile(
+    rb"(?:[^\n]*" + re.escape(APP_ERR) + rb"[^\n]*(?:\n|\Z)|" + FRAME_LINE + rb")*"
+)
+
+
+def frame_times(buf, pos, end, n_frames):
+    """
+    Timestamps of the frame lines in buf[pos:end], indexed by frame id (1..n_frames).
+    Frames without a line are NaN.
+    """
+    matches = FRAME_RE.findall(buf, pos, end)
+    ids = np.fromiter((int(i) for i, _ in matches), np.int64, len(matches))
+    ts = np.fromiter((float(t) for _, t in matches), np.float64, len(matches))
+    keep = (ids >= 1) & (ids <= n_frames)
+    times = np.full(n_frames + 1, np.nan)
+    times[ids[keep]] = ts[keep]
+    return times
 
 
-def parse_one_trail(lines):
+def parse_one_trail(buf, pos):
     """
-    Parse one trail's data from the log lines.
+    Parse one trail's data from the log bytes (e.g. an mmap), starting at offset pos.
+    Return the offset where the next trail's parse starts (None at the end), and the data:
+    (server timestamps, client timestamps), both indexed by frame id.
     """
-    data = (
-        {}
-    )  # data: {end(server/client) : timestamps}; timestamps: {frame id: timestamp}
-    data["server"] = {}
-    data["client"] = {}
-    begin_data = None
-    video_long = None
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        i += 1
-        line = line.strip()
-        # found the data size, prepare to read data
-        if "RTC Server GetN request:" in line:
-            begin_data = "server"
-            # example1: RTC Server GetN request: 300 frames
-            # example2: RTC Server GetN request: 300 frames, each is 12500 B
-            if "each is" in line:
-                line = line.split("each is", 1)[0].rstrip(" ,")
-            video_long = int(line.split(" ")[-2]) / 30
-            # print(f"video_long: {video_long}")
-            continue
-        if begin_data is None:  # wait server data
-            continue
-        if not line.startswith("frame "):
-            # Done reading data for this trail
-            begin_data = "client"
-        else:
-            # Read a data point
-            # example: frame 6, sent time: 420.885449
-            line = line.split(" ")
-            frame = int(line[1][:-1])
-            time = float(line[-1])
-            data["server"][frame] = time
-
-        # after server data, read client data
-        if begin_data == "client":
-            begin = False  # turn True when find the begin of client data
-            i = i - 1  # go back one line to re-process this line
-            while i < len(lines):
-                line = lines[i]
-                i += 1
-                line = line.strip()
-                if "GetN request:" in line and "seconds" in line:
-                    # GetN request: 300 frames( 10 seconds)
-                    client_video_long = int(line.split(" ")[-2])
-                    assert client_video_long == video_long
-                    begin = True
-                    continue
-                if "Application error 0x0 (remote)" in line:
-                    continue
-                if not begin:
-                    continue
-                if not line.startswith("frame "):
-                    # Done reading data for this trail
-                    begin_data = None
-                    video_long = None
-                    return i, data
-                else:
-                    # Read a data point
-                    # example: frame 1, fin time: 287.208894
-                    line = line.split(" ")
-                    frame = int(line[1][:-1])
-                    time = float(line[-1])
-                    data["client"][frame] = time
-    return None, data  # no data found, end the parse
+    # found the data size, prepare to read data
+    m = SERVER_GETN_RE.search(buf, pos)
+    if m is None:
+        return None, None  # no data found, end the parse
+    n_frames = int(m.group(1))
+    video_long = n_frames / 30
+    # server data: the frame lines right after the request line
+    pos = buf.find(b"\n", m.end()) + 1 or len(buf)
+    end = SERVER_BLOCK_RE.match(buf, pos).end()
+    server = frame_times(buf, pos, end, n_frames)
+    pos = end
+
+    # after server data, read client data
+    m = CLIENT_GETN_RE.search(buf, pos)
+    if m is None:
+        return None, None
+    client_video_long = int(m.group(1))
+    assert client_video_long == video_long
+    pos = m.end() + 1
+    # the block ends at the first line that is neither a frame nor an app error
+    end = CLIENT_BLOCK_RE.match(buf, pos).end()
+    client = frame_times(buf, pos, end, n_frames)
+    # Done reading data for this trail
+    return end, (server, client)
 
 
 def parse_data(logfile="run.txt", trials=1, video_long=20):
@@ -100,22 +94,32 @@ def parse_data(logfile="run.txt", trials=1, video_long=20):
     data = []
     assert os.path.exists(logfile), f"file not found: {logfile}"
 
-    with open(logfile) as f:
-        lines = f.read().split("\n")
-    while len(data) < trials:
-        # print(f"len(lines): {len(lines)}")
-        used_line, d = parse_one_trail(lines)
-        if used_line is None:
-            break
-
-        lines = lines[used_line:]
-        if d["server"] == {} or d["client"] == {}:
-            continue
-        # print(f"trail {len(data)}: {len(d['server'])} frames")
-        if len(d["server"]) != video_long * 30 or len(d["client"]) != video_long * 30:
-            print(f"warning: trail {len(data)}: {len(d['server'])} frames")
-            continue
-        data.append(d)
+    if os.path.getsize(logfile) == 0:
+        return data  # empty files can't be mapped
+
+    # map the file instead of reading it: only matched fields are copied out
+    with open(logfile, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buf:
+        pos = 0
+        while len(data) < trials:
+            pos, d = parse_one_trail(buf, pos)
+            if pos is None:
+                break
+
+            # number of frames found on each end
+            n_server, n_client = (np.count_nonzero(~np.isnan(t)) for t in d)
+            if n_server == 0 or n_client == 0:
+                continue
+            # print(f"trail {len(data)}: {n_server} frames")
+            if (
+                len(d[0]) != video_long * 30 + 1
+                or n_server != video_long * 30
+                or n_client != video_long * 30
+            ):
+                print(f"warning: trail {len(data)}: {n_server} frames")
+                continue
+            data.append(d)
     return data
 
 
@@ -127,35 +131,34 @@ def compute_frame_stats(data, video_long):
 
     reference: Enabling passive measurement of zoom performance in production networks (IMC ’22), and RFC 3550.
     """
-    frame_delays = []
-    jitter = []
     ideal_interval = 1.0 / 30.0  # 30 fps
-    for d in data:
-        last_fin = None
-        interval_sample = None
-        jitter_sample = 0.0
-        for i in range(1, video_long * 30 + 1):
-            frame_delays.append(d["client"][i] - d["server"][i])
-            # to ms
-            frame_delays[-1] *= 1000
-            if last_fin is not None:
-                # D(i,j) = (Rj - Ri) - (Sj - Si)
-                # J(i) = J(i-1) + (|D(i-1,i)| - J(i-1))/16
-                interval_sample = d["client"][i] - last_fin
-                diff = abs(interval_sample - ideal_interval)
-                jitter_sample = jitter_sample + (diff - jitter_sample) / 16.0
-                jitter.append(jitter_sample * 1000)
-            last_fin = d["client"][i]
-    frame_delays.sort()
-    jitter.sort()
+    n_frames = video_long * 30
+    # sizes are known up front: fill per-trial slices of preallocated arrays
+    frame_delays = np.empty(len(data) * n_frames)
+    jitter = np.empty(len(data) * (n_frames - 1))
+    for k, (server, client) in enumerate(data):
+        # index 0 is unused, frame ids start from 1
+        server = server[1:]
+        client = client[1:]
+        # to ms
+        delays = frame_delays[k * n_frames : (k + 1) * n_frames]
+        np.multiply(client - server, 1000, out=delays)
+        # D(i,j) = (Rj - Ri) - (Sj - Si)
+        # J(i) = J(i-1) + (|D(i-1,i)| - J(i-1))/16, i.e. IIR filter y = x/16 + 15/16*y[-1]
+        diffs = np.abs(np.diff(client) - ideal_interval)
+        jitter_samples = lfilter([1 / 16.0], [1.0, -15 / 16.0], diffs)
+        samples = jitter[k * (n_frames - 1) : (k + 1) * (n_frames - 1)]
+        np.multiply(jitter_samples, 1000, out=samples)
+    # not sorted, print_key_points selects the percentiles
     return frame_delays, jitter
 
 
 def print_key_points(data, title):
     n = len(data)
-    print(
-        f"{title}: 99%: {data[int(n*0.99)]}, 95%: {data[int(n*0.95)]}, 90%: {data[int(n*0.9)]}, 50%: {data[int(n*0.5)]}"
-    )
+    # same index-based percentiles as on sorted data, in O(n) with introselect
+    idx = [int(n * 0.99), int(n * 0.95), int(n * 0.9), int(n * 0.5)]
+    p99, p95, p90, p50 = np.partition(data, idx)[idx].tolist()
+    print(f"{title}: 99%: {p99}, 95%: {p95}, 90%: {p90}, 50%: {p50}")
 
 
 if __name__ == "__main__":
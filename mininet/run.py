@@ -67,6 +67,8 @@ def http_func(args, net):
     client_cmd = (
         f"{net.client_mm_prefix} python3 apps/http/http_client.py --addr {net.h2.IP()}:443 -n {args.n} "
         f"--trials {args.trials} "
+        f"{'--reuse-conn ' if args.reuse_conn else ''}"
+        f"{f'--tls-sessions {args.tls_sessions} ' if args.tls_sessions else ''}"
         f"--stdout {args.stdout} --stderr {args.stderr} "
         f"--timeout {timeout} "
         f"{args.proto} "
@@ -318,6 +320,18 @@ http.add_argument(
 http.add_argument(
     "-t", "--trials", type=int, default=1, help="Number of trials (default: 1)."
 )
+http.add_argument(
+    "--reuse-conn",
+    action="store_true",
+    default=False,
+    help="Run all trials in one curl (chained with --next) that reuses the connection.",
+)
+http.add_argument(
+    "--tls-sessions",
+    default=None,
+    metavar="FILENAME",
+    help="File for curl to keep TLS session tickets in, so later trials resume the session.",
+)
 ############################################################################
 
 if __name__ == "__main__":
@@ -342,21 +356,29 @@ if __name__ == "__main__":
     # init arp
     net.init_arp()
 
-    # start packet capture
-    if args.cap:
-        net.start_capture(args, net)
-
-    # start the pemi
-    if args.pep:
-        net.start_tcp_pep()
-    if args.pemi or args.pemi_proxy_only:
-        net.start_pemi(
-            args.log_level, args.fl_inv_factor, args.fl_end_factor, args.pemi_proxy_only
-        )
     try:
+        # start packet capture
+        if args.cap:
+            net.start_capture(args)
+
+        # start the pemi
+        if args.pep:
+            net.start_tcp_pep()
+        if args.pemi or args.pemi_proxy_only:
+            net.start_pemi(
+                args.log_level,
+                args.fl_inv_factor,
+                args.fl_end_factor,
+                args.pemi_proxy_only,
+            )
         args.func(args, net)
     except Exception as e:
         pemilog(f"[Error] error occurred: {e}")
-        net.stop()
         raise e
-    net.stop()
+    finally:
+        # flush and split the capture of failed runs too
+        try:
+            if args.cap:
+                net.stop_capture()
+        finally:
+            net.stop()
@@ -7,16 +7,22 @@ Timestamps:
 """
 
 import sys
+import re
+import heapq
 from common import *
 import argparse
+import numpy as np
+import pandas as pd
 
 
 # %%
 class packet:
+    __slots__ = ("direction", "time", "id", "replyed")
+
     def __init__(self, line):
         self.direction = line[0]
         self.time_from_str(line[1])
-        self.id = line[2]
+        self.id = int(line[2], 16)  # hex id as int: cheaper to hash
 
     def time_from_str(self, ts):
         self.time = time_from_str(ts)
@@ -31,14 +37,17 @@ class packet:
 
 
 class PEMI_packet(packet):
+    __slots__ = ("sender",)
+
     def __init__(self, line, sender):
         self.sender = sender  # server or client
         self.direction = "pemi"
         self.time_from_str(line[3])
-        self.id = line[4]
+        self.id = int(line[4], 16)
 
 
 def process_duplicated_pkt(pkt_id):
+    pkt_id = f"{pkt_id:032x}"
     # if begin with "c" and end with "000": may be a client handshake packet
     # if begin with "f0000": may be a server handshake packet
     if (pkt_id.startswith("c") and pkt_id.endswith("000")) or pkt_id.startswith(
@@ -50,19 +59,26 @@ def process_duplicated_pkt(pkt_id):
         raise ValueError("duplicated packet id " + pkt_id)
 
 
+# "[INFO] send <time> <id>" / "recv <time> <id>"
+PKT_PREFIXES = ("send ", "recv ", "[INFO] send ", "[INFO] recv ")
+PKT_RE = re.compile(r"(?:\[INFO\]\s+)?(send|recv)\s+(\S+)\s+(\S+)")
+
+
 # analyze send/recv packets of one peer
 class peer_packets:
     def __init__(self, log_file, analyze_reply=False):
         self.recv = {}
         self.send = {}
         burst_recv = []
-        with open(log_file, "r") as f:
+        with open(log_file, "r", buffering=1 << 20) as f:
             for line in f:
-                line = line.strip().split()
-                if line[0] == "[INFO]":
-                    line = line[1:]  # remove [INFO] prefix
-                if len(line) < 3:
+                # cheap guard before any regex work on non-packet lines
+                if not line.startswith(PKT_PREFIXES):
+                    continue
+                m = PKT_RE.match(line)
+                if m is None:
                     continue
+                line = m.groups()
                 if line[0] == "send":
                     pkt = packet(line)
                     if pkt.id in self.send:
@@ -71,7 +87,7 @@ class peer_packets:
                         pkt.set_replyed(burst_recv)
                     self.send[pkt.id] = pkt
                     burst_recv = []
-                elif line[0] == "recv":
+                else:
                     pkt = packet(line)
                     if pkt.id in self.recv:
                         if not PEMI:
@@ -108,12 +124,12 @@ class pemi_packets:
                     if pkt.sender == "server":
                         if pkt.id not in server_pkts.send:
                             raise ValueError(
-                                f"PEMI processed unknown packet id from server: {pkt.id}"
+                                f"PEMI processed unknown packet id from server: {pkt.id:032x}"
                             )
                     elif pkt.sender == "client":
                         if pkt.id not in client_pkts.send:
                             raise ValueError(
-                                f"PEMI processed unknown packet id from client: {pkt.id}"
+                                f"PEMI processed unknown packet id from client: {pkt.id:032x}"
                             )
 
     def process_time(self, id):
@@ -162,41 +178,35 @@ if __name__ == "__main__":
     start_time = h1_packets.send[first_send_pkt_id].time
     print(f"start time: {start_time}")
 
-    summary = open(f"{args.log_dir}/summary_log.csv", "w")
-    summary.write("direction,num,send_time,mid_time,recv_time,id,replyed\n")
-    h1_idx = 0
-    h2_idx = 0
-    keys_h1_send = list(h1_packets.send.keys())
-    keys_h2_send = list(h2_packets.send.keys())
-    while h1_idx < len(keys_h1_send) or h2_idx < len(keys_h2_send):
-        h1_time = (
-            h1_packets.send[keys_h1_send[h1_idx]].time
-            if h1_idx < len(keys_h1_send)
-            else float("inf")
-        )
-        h2_time = (
-            h2_packets.send[keys_h2_send[h2_idx]].time
-            if h2_idx < len(keys_h2_send)
-            else float("inf")
-        )
-        num = h1_idx + h2_idx + 1
-        if h1_time < h2_time:
-            h1_pkt = h1_packets.send[keys_h1_send[h1_idx]]
-            direction = "h1->"
-            send_time = get_time(h1_time)
-            id = h1_pkt.id
+    # one column per field, filled during the merge; object dtype keeps the
+    # -1 markers as ints next to float times
+    n = len(h1_packets.send) + len(h2_packets.send)
+    columns = ("direction", "send_time", "mid_time", "recv_time", "id", "replyed")
+    summary = {col: np.empty(n, dtype=object) for col in columns}
+    # streaming two-way merge on send time; on equal times the original loop
+    # emitted h2 first, and heapq.merge keeps ties in iterable order
+    merged = heapq.merge(
+        (("<-h2", pkt) for pkt in h2_packets.send.values()),
+        (("h1->", pkt) for pkt in h1_packets.send.values()),
+        key=lambda item: item[1].time,
+    )
+    for i, (direction, pkt) in enumerate(merged):
+        id = pkt.id
+        if direction == "h1->":
             recv_time = get_time(h2_packets.recv_time(id))
-            replyed = h1_pkt.get_replyed()
-            h1_idx += 1
+            replyed = pkt.get_replyed()
         else:
-            h2_pkt = h2_packets.send[keys_h2_send[h2_idx]]
-            direction = "<-h2"
-            send_time = get_time(h2_time)
-            id = h2_pkt.id
             recv_time = get_time(h1_packets.recv_time(id))
             replyed = ""  # haven't analyzed h2's replyed packets
-            h2_idx += 1
-        r1_time = r1_packets.process_time(id)
-        summary.write(
-            f"{direction},{num},{send_time},{r1_time},{recv_time},{id},{replyed}\n"
-        )
+        summary["direction"][i] = direction
+        summary["send_time"][i] = get_time(pkt.time)
+        summary["mid_time"][i] = r1_packets.process_time(id)
+        summary["recv_time"][i] = recv_time
+        summary["id"][i] = f"{id:032x}"
+        summary["replyed"][i] = replyed
+    summary["num"] = np.arange(1, n + 1)
+    pd.DataFrame(summary).to_csv(
+        f"{args.log_dir}/summary_log.csv",
+        index=False,
+        columns=["direction", "num", *columns[1:]],
+    )
@@ -4,7 +4,10 @@ Output csv files. All timestamps are starting from the first packet of h1.
 """
 
 # %%
-from scapy.all import rdpcap
+import csv
+import dpkt
+import numpy as np
+import socket
 import os
 import argparse
 
@@ -23,13 +26,92 @@ args = parser.parse_args()
 pcap_dir = args.pcap_dir
 os.system(f"sudo chmod 777 {pcap_dir}/*.pcap")
 
-h1_packets = rdpcap(f"{pcap_dir}/h1-eth0.pcap")
-h2_packets = rdpcap(f"{pcap_dir}/h2-eth0.pcap")
-r1_packets = rdpcap(f"{pcap_dir}/r1-eth0.pcap")
+
+# use first 8 bytes + last 8 bytes of UDP payload as packet id
+def get_pkt_id(payload):
+    # kept as an int, converted to hex only when written to csv
+    return int.from_bytes(payload[:8] + payload[-8:], "big")
+
+
+def extract_packets(pcap_file):
+    """
+    Stream a pcap/pcapng file and keep only the fields used by the analysis, as arrays.
+    Time is in integer microseconds, the 128-bit packet id is split into two uint64s.
+    Non-UDP packets have empty IPs. dup marks packets whose id is repeated by one
+    of the next 2 packets (lost handshaking packets).
+    """
+    times, srcs, dsts, sizes, ids = [], [], [], [], []
+    with open(pcap_file, "rb") as f:
+        for ts, buf in dpkt.pcap.UniversalReader(f):
+            times.append(round(ts * 1000000))
+            sizes.append(len(buf))
+            ip = dpkt.ethernet.Ethernet(buf).data
+            if isinstance(ip, dpkt.ip.IP) and isinstance(ip.data, dpkt.udp.UDP):
+                srcs.append(socket.inet_ntoa(ip.src))
+                dsts.append(socket.inet_ntoa(ip.dst))
+                ids.append(get_pkt_id(ip.data.data))
+            else:
+                srcs.append("")
+                dsts.append("")
+                ids.append(None)
+    n = len(ids)
+    dup = [
+        pid is not None and i + 2 < n and (ids[i + 1] == pid or ids[i + 2] == pid)
+        for i, pid in enumerate(ids)
+    ]
+    ids = [0 if pid is None else pid for pid in ids]
+    return {
+        "time": np.array(times, dtype=np.int64),
+        "src": np.array(srcs, dtype="U15"),
+        "dst": np.array(dsts, dtype="U15"),
+        "size": np.array(sizes, dtype=np.int64),
+        "id_hi": np.array([pid >> 64 for pid in ids], dtype=np.uint64),
+        "id_lo": np.array([pid & 0xFFFFFFFFFFFFFFFF for pid in ids], dtype=np.uint64),
+        "dup": np.array(dup, dtype=bool),
+    }
+
+
+def load_packets(pcap_file):
+    """
+    Load (time, src IP, dst IP, size, packet id, dup) per packet.
+    IPs and id are None for non-UDP packets.
+    The extracted arrays are cached next to the pcap as .npz, and rebuilt when the pcap
+    is newer than the cache.
+    """
+    cache = os.path.splitext(pcap_file)[0] + ".npz"
+    if os.path.exists(cache) and os.path.getmtime(cache) > os.path.getmtime(pcap_file):
+        with np.load(cache) as f:
+            data = {k: f[k] for k in f.files}
+    else:
+        data = extract_packets(pcap_file)
+        try:
+            np.savez(cache, **data)
+        except OSError as e:
+            print(f"warn: can't write cache {cache}: {e}")
+    ids = [
+        (hi << 64) | lo
+        for hi, lo in zip(data["id_hi"].tolist(), data["id_lo"].tolist())
+    ]
+    return [
+        (time, src, dst, size, pid, dup) if src else (time, None, None, size, None, dup)
+        for time, src, dst, size, pid, dup in zip(
+            data["time"].tolist(),
+            data["src"].tolist(),
+            data["dst"].tolist(),
+            data["size"].tolist(),
+            ids,
+            data["dup"].tolist(),
+        )
+    ]
+
+
+h1_packets = load_packets(f"{pcap_dir}/h1-eth0.pcap")
+h2_packets = load_packets(f"{pcap_dir}/h2-eth0.pcap")
+r1_packets = load_packets(f"{pcap_dir}/r1-eth0.pcap")
 
 # use h1 1st packet.time as start time
-start_time = h1_packets[0].time
-print(f"start time: {start_time}")
+start_time = h1_packets[0][0]
+print(f"start time: {start_time / 1000000}")
 
 h1_IP = "10.0.1.10"
 h2_IP = "10.0.2.10"
@@ -56,73 +138,90 @@ class statistics:
 
 
 def get_time(timestamp):
-    return round((timestamp - start_time) * 1000, 1)  # ms, keep 1 decimal places
+    # ms, keep 1 decimal places. Integer math: round half to even, like Decimal timestamps
+    q, r = divmod(timestamp - start_time, 100)
+    if r > 50 or (r == 50 and q % 2 == 1):
+        q += 1
+    return q / 10
 
 
-# use first 8 bytes + last 8 bytes of UDP payload as packet id
-def get_pkt_id(pkt):
-    id = pkt["UDP"].load[:8] + pkt["UDP"].load[-8:]
-    # return as hex
-    return id.hex()
+def index_packets(packets):
+    """
+    Map (src IP, dst IP) -> {packet id -> time of the first UDP packet with that id},
+    in a single pass over the packets.
+    """
+    idx = {}
+    for time, src, dst, _, pid, _ in packets:
+        if src is not None:
+            idx.setdefault((src, dst), {}).setdefault(pid, time)
+    return idx
 
 
-def analyze_packets(
-    src_packets, middlebox_packets, dst_packets, src_IP, dst_IP, csv_file
-):
+def analyze_packets(src_packets, r1_idx, dst_idx, src_IP, dst_IP, csv_file):
+    """
+    r1_idx and dst_idx: packet id -> time of first arrival of the src -> dst packets
+    seen by the middlebox and dst.
+    """
     stats = statistics()
     print(f"Analyzing {src_IP} -> {dst_IP}")
     # output csv
-    for i, pkt in enumerate(src_packets):
-        if pkt.haslayer("UDP"):
+    rows = []
+    for i, (time, src, dst, size, pid, dup) in enumerate(src_packets):
+        if src is not None:
             # only consider src -> dst packets
-            if pkt["IP"].src != src_IP or pkt["IP"].dst != dst_IP:
+            if src != src_IP or dst != dst_IP:
                 continue
             stats.sent += 1
             # get fields
             id = i + 1
-            size = len(pkt)
-            src_time = get_time(pkt.time)
+            src_time = get_time(time)
             mid_time = -1
             dst_time = -1
             # check next 2 packets to find lost handshaking packets
-            if i + 2 < len(src_packets) and (
-                src_packets[i + 1]["UDP"] == pkt["UDP"]
-                or src_packets[i + 2]["UDP"] == pkt["UDP"]
-            ):
+            if dup:
                 # duplicate packet, this packet is lost
                 print(f"Packet {id} is lost")
                 pass
             else:
-                for mid_pkt in middlebox_packets:
-                    if pkt["UDP"] == mid_pkt["UDP"]:
-                        mid_time = get_time(mid_pkt.time)
-                        stats.arrive_mid += 1
-                        break
-                for dst_pkt in dst_packets:
-                    if pkt["UDP"] == dst_pkt["UDP"]:
-                        dst_time = get_time(dst_pkt.time)
-                        stats.arrive_dst += 1
-                        break
-            # write to csv
-            csv_file.write(
-                f"{id},{size},{src_time},{mid_time},{dst_time},{get_pkt_id(pkt)}\n"
-            )
-            # print(f"{id},{size},{src_time},{mid_time},{dst_time},{get_pkt_id(pkt)}")
+                if pid in r1_idx:
+                    mid_time = get_time(r1_idx[pid])
+                    stats.arrive_mid += 1
+                if pid in dst_idx:
+                    dst_time = get_time(dst_idx[pid])
+                    stats.arrive_dst += 1
+            rows.append((id, size, src_time, mid_time, dst_time, f"{pid:032x}"))
+            # print(f"{id},{size},{src_time},{mid_time},{dst_time},{pid:032x}")
         else:
             # raise error
             raise ValueError("Packet is not UDP")
+    # write to csv
+    csv.writer(csv_file, lineterminator="\n").writerows(rows)
     return stats
 
 
 # %%
+# index each capture once, shared by both directions
+r1_idx = index_packets(r1_packets)
+h1_idx = index_packets(h1_packets)
+h2_idx = index_packets(h2_packets)
 
 h1toh2_stats = analyze_packets(
-    h1_packets, r1_packets, h2_packets, h1_IP, h2_IP, h1toh2_csv
+    h1_packets,
+    r1_idx.get((h1_IP, h2_IP), {}),
+    h2_idx.get((h1_IP, h2_IP), {}),
+    h1_IP,
+    h2_IP,
+    h1toh2_csv,
 )
 h1toh2_csv.close()
 # %%
 h2toh1_stats = analyze_packets(
-    h2_packets, r1_packets, h1_packets, h2_IP, h1_IP, h2toh1_csv
+    h2_packets,
+    r1_idx.get((h2_IP, h1_IP), {}),
+    h1_idx.get((h2_IP, h1_IP), {}),
+    h2_IP,
+    h1_IP,
+    h2toh1_csv,
 )
 h2toh1_csv.close()
 # %%
@@ -147,35 +246,18 @@ h1_to_h2 = pd.read_csv("h1-h2.csv")
 h2_to_h1 = pd.read_csv("h2-h1.csv")
 
 # write to summary
-# write by the send_time
-summary = open("summary.csv", "w")
-summary.write("direction,num,size,send_time,r1_time,recv_time,id\n")
-h1_idx = 0
-h2_idx = 0
-while h1_idx < len(h1_to_h2) and h2_idx < len(h2_to_h1):
-    h1_time = h1_to_h2.loc[h1_idx, "h1_time"]
-    h2_time = h2_to_h1.loc[h2_idx, "h2_time"]
-    if h1_time < h2_time:
-        summary.write(
-            f"h1->,{h1_to_h2.loc[h1_idx, 'num']},{h1_to_h2.loc[h1_idx, 'size']},{h1_to_h2.loc[h1_idx, 'h1_time']},{h1_to_h2.loc[h1_idx, 'r1_time']},{h1_to_h2.loc[h1_idx, 'h2_time']},{h1_to_h2.loc[h1_idx, 'id']}\n"
-        )
-        h1_idx += 1
-    else:
-        summary.write(
-            f"<-h2,{h2_to_h1.loc[h2_idx, 'num']},{h2_to_h1.loc[h2_idx, 'size']},{h2_to_h1.loc[h2_idx, 'h2_time']},{h2_to_h1.loc[h2_idx, 'r1_time']},{h2_to_h1.loc[h2_idx, 'h1_time']},{h2_to_h1.loc[h2_idx, 'id']}\n"
-        )
-        h2_idx += 1
-# %% write remaining records
-while h1_idx < len(h1_to_h2):
-    summary.write(
-        f"h1->,{h1_to_h2.loc[h1_idx, 'num']},{h1_to_h2.loc[h1_idx, 'size']},{h1_to_h2.loc[h1_idx, 'h1_time']},{h1_to_h2.loc[h1_idx, 'r1_time']},{h1_to_h2.loc[h1_idx, 'h2_time']},{h1_to_h2.loc[h1_idx, 'id']}\n"
-    )
-    h1_idx += 1
-while h2_idx < len(h2_to_h1):
-    summary.write(
-        f"<-h2,{h2_to_h1.loc[h2_idx, 'num']},{h2_to_h1.loc[h2_idx, 'size']},{h2_to_h1.loc[h2_idx, 'h2_time']},{h2_to_h1.loc[h2_idx, 'r1_time']},{h2_to_h1.loc[h2_idx, 'h1_time']},{h2_to_h1.loc[h2_idx, 'id']}\n"
-    )
-    h2_idx += 1
-summary.close()
+# write by the send_time; h2 rows go first so that a stable sort keeps
+# them ahead of h1 rows sent at the same time
+h1_to_h2 = h1_to_h2.rename(columns={"h1_time": "send_time", "h2_time": "recv_time"})
+h2_to_h1 = h2_to_h1.rename(columns={"h2_time": "send_time", "h1_time": "recv_time"})
+summary = pd.concat(
+    [h2_to_h1.assign(direction="<-h2"), h1_to_h2.assign(direction="h1->")],
+    ignore_index=True,
+).sort_values("send_time", kind="stable")
+summary.to_csv(
+    "summary.csv",
+    index=False,
+    columns=["direction", "num", "size", "send_time", "r1_time", "recv_time", "id"],
+)
 
 # %%
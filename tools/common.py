@@ -1,14 +1,15 @@
+# two-char time unit suffix -> divisor to ms; plain "s" is handled separately
+TIME_UNITS = {"ms": 1, "us": 1000, "µs": 1000, "ns": 1000000}
+
+
 def time_from_str(ts):
     """
     input the time ends with units, like "ms", "s", "us", "ns"
     output time in ms
     """
-    if ts.endswith("ms"):
-        return float(ts[:-2])
-    elif ts.endswith("us") or ts.endswith("µs"):
-        return float(ts[:-2]) / 1000
-    elif ts.endswith("ns"):
-        return float(ts[:-2]) / 1000000
+    div = TIME_UNITS.get(ts[-2:])
+    if div is not None:
+        return float(ts[:-2]) / div
     elif ts.endswith("s"):
         return float(ts[:-1]) * 1000
     else:
@@ -4,42 +4,321 @@ r1.log -> trace as json
 
 # %%
 
-from common import *
+from common import TIME_UNITS
+import os
+import re
+import gzip
+import mmap
+import stat
 import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+
+try:
+    import orjson  # optional, much faster than json for large traces
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # optional, for --format msgpack
+except ImportError:
+    msgpack = None
 
 SERVER_IP = "10.0.2.10"
 CLIENT_IP = "10.0.1.10"
 
+# time unit -> conversion to ms, same arithmetic as time_from_str
+TO_MS = {
+    unit.encode(): (lambda v, div=div: v / div) for unit, div in TIME_UNITS.items()
+}
+TO_MS[b"s"] = lambda v: v * 1000  # after the two-char units, see PKT_RE
+
+PKT_PREFIX = b"[INFO] process pkt"
+# example: [INFO] process pkt(server) 1.830913ms f000000001148edb5df6afa99e3f102a 1242B
+# the look-behind keeps matches at line starts, while the leading literal still lets
+# the regex engine skip ahead to candidate lines quickly (a leading ^ would not).
+# The side group captures b"c" for the client and b"" for the server, both cached
+# bytes objects, so no per-line side string is allocated.
+# Fields are split on runs of whitespace like str.split(): the optional field after
+# the id is the size with its unit letter, anything after it is ignored
+PKT_RE = re.compile(
+    rb"\[INFO\] process pkt(?<![^\n]\[INFO\] process pkt)"
+    rb"\((?:(c)lient|server)\)[^\S\n]+([-+.\deE]+)("
+    + b"|".join(map(re.escape, TO_MS))
+    + rb")[^\S\n]+(\S+)(?:[^\S\n]+(\S+))?"
+)
+CHUNK_SIZE = 16 << 20  # bytes of log parsed at once
+
+
+def next_pkt_line(buf, pos):
+    """
+    Offset of the next line starting with PKT_PREFIX after pos, or -1 if none.
+    """
+    hit = buf.find(b"\n" + PKT_PREFIX, pos)
+    return hit + 1 if hit >= 0 else -1
+
+
+def iter_chunks(buf, chunk_size=CHUNK_SIZE):
+    """
+    Split buf into (start, end) ranges of about chunk_size bytes, ending after a newline.
+    """
+    start = 0
+    while start < len(buf):
+        end = buf.find(b"\n", start + chunk_size) + 1 or len(buf)
+        yield start, end
+        start = end
+
+
+def count_pkt_lines(buf, start, end):
+    """
+    Number of lines in buf[start:end] starting with PKT_PREFIX.
+    """
+    chunk = buf[start:end]  # mmap has no count()
+    return chunk.count(b"\n" + PKT_PREFIX) + chunk.startswith(PKT_PREFIX)
+
+
+def check_pkt_lines(buf, start, end):
+    """
+    Raise on the first line in buf[start:end] starting with PKT_PREFIX that PKT_RE can't parse.
+    """
+    if buf[start : start + len(PKT_PREFIX)] == PKT_PREFIX:
+        pos = start
+    else:
+        pos = next_pkt_line(buf, start)
+    while 0 <= pos < end:
+        if PKT_RE.match(buf, pos) is None:
+            eol = buf.find(b"\n", pos)
+            line = buf[pos : eol if eol >= 0 else end].decode()
+            raise ValueError(f"Unknown pkt line: {line}")
+        pos = next_pkt_line(buf, pos)
+
+
+def parse_chunk(buf, start, end):
+    """
+    Parse all packet lines in buf[start:end] with one regex pass.
+
+    :return: (is_client, timestamps in ms, ids, sizes) as numpy arrays. ids are kept as
+             fixed-width bytes, and decoded only when the trace is written
+    """
+    rows = PKT_RE.findall(buf, start, end)
+    if len(rows) != count_pkt_lines(buf, start, end):
+        check_pkt_lines(buf, start, end)
+    if not rows:
+        return np.empty(0, bool), np.empty(0), np.empty(0, "S1"), np.empty(0, np.int64)
+    is_client = np.array([row[0] for row in rows], "S1") == b"c"
+    values = np.array([row[1] for row in rows]).astype(np.float64)
+    # to ms: dispatch once per unit present instead of evaluating every unit
+    unit_col = [row[2] for row in rows]
+    if unit_col.count(unit_col[0]) == len(unit_col):
+        # usually the whole log uses one unit: no masks needed
+        times = TO_MS[unit_col[0]](values)
+    else:
+        units = np.array(unit_col)
+        times = np.empty_like(values)
+        for unit in set(unit_col):
+            mask = units == unit
+            times[mask] = TO_MS[unit](values[mask])
+    ids = np.array([row[3] for row in rows])
+    # drop the unit letter ("1242B"), an unparsable size raises ValueError
+    sizes = np.array([row[4][:-1] if row[4] else b"-1" for row in rows])
+    sizes = sizes.astype(np.int64)
+    return is_client, times, ids, sizes
+
+
+def iter_stream_chunks(f, chunk_size=CHUNK_SIZE):
+    """
+    Read a binary stream in chunks of about chunk_size bytes, each ending after a newline.
+    """
+    tail = b""
+    while data := f.read(chunk_size):
+        data = tail + data
+        cut = data.rfind(b"\n") + 1
+        tail = data[cut:]
+        if cut:
+            yield data[:cut]
+    if tail:
+        yield tail
+
 
-def get_pkt_traces(log_file):
+def parse_file_chunk(log_file, start, end):
+    """
+    parse_chunk on bytes [start, end) of the log, mapped by the calling (worker) process.
+    """
+    with open(log_file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return parse_chunk(buf, start, end)
+
+
+def iter_pkt_chunks(log_file, jobs=1):
+    """
+    Yield parse_chunk results over r1.log in log order, CHUNK_SIZE bytes at a time.
+    With jobs > 1, mapped logs are split into at least jobs chunks parsed by a pool of
+    processes. Logs ending with .gz are decompressed while they are read.
+    """
+    if log_file.endswith(".gz"):
+        with gzip.open(log_file, "rb") as f:
+            for chunk in iter_stream_chunks(f):
+                yield parse_chunk(chunk, 0, len(chunk))
+        return
+    with open(log_file, "rb", buffering=1 << 20) as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # empty files, pipes and other inputs that can't be mapped: read as a stream
+            for chunk in iter_stream_chunks(f):
+                yield parse_chunk(chunk, 0, len(chunk))
+            return
+        with buf:
+            if jobs > 1:
+                chunk_size = min(CHUNK_SIZE, len(buf) // jobs + 1)
+                ranges = list(iter_chunks(buf, chunk_size))
+            else:
+                for start, end in iter_chunks(buf):
+                    yield parse_chunk(buf, start, end)
+                return
+        starts, ends = zip(*ranges)
+        with ProcessPoolExecutor(jobs) as pool:
+            yield from pool.map(parse_file_chunk, repeat(log_file), starts, ends)
+
+
+def warn_missing_sizes(chunks):
+    """
+    Pass parse_chunk results through, then print a single warning for all the packets
+    without a size (fake size -1).
+    """
+    n_missing = 0
+    first_id = None
+    for chunk in chunks:
+        missing = np.flatnonzero(chunk[3] == -1)
+        if len(missing) and first_id is None:
+            first_id = chunk[2][missing[0]].decode()
+        n_missing += len(missing)
+        yield chunk
+    if n_missing:
+        print(
+            f"Warning: no size for {n_missing} packets (first: {first_id}), "
+            "using fake size -1"
+        )
+
+
+def iter_pkts(log_file, jobs=1):
+    """
+    Yield the packets observed by the middlebox (mid) in both directions from r1.log,
+    as (side, timestamp, id, size) in log order. side is "client" or "server".
+
+    :param log_file: Path to the log file
+    :param jobs: Number of processes parsing the log
+    """
+    chunks = warn_missing_sizes(iter_pkt_chunks(log_file, jobs))
+    for is_client, times, ids, sizes in chunks:
+        sides = ("client" if c else "server" for c in is_client.tolist())
+        ids = map(bytes.decode, ids.tolist())
+        yield from zip(sides, times.tolist(), ids, sizes.tolist())
+
+
+def count_log_pkts(log_file):
+    """
+    Number of packet lines in the log, or None if it isn't a regular file (e.g. a pipe,
+    which can only be read once) or is gzipped.
+    """
+    st = os.stat(log_file)
+    if not stat.S_ISREG(st.st_mode) or log_file.endswith(".gz"):
+        return None
+    if st.st_size == 0:
+        return 0
+    with open(log_file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return sum(
+                count_pkt_lines(buf, start, end) for start, end in iter_chunks(buf)
+            )
+
+
+def read_pkts(log_file, jobs=1):
+    """
+    Read all packets of the log as columns, in log order.
+    The columns are allocated once from a first counting pass when the log can be mapped.
+
+    :return: (is_client, timestamps in ms, ids, sizes) as numpy arrays, like parse_chunk
+    """
+    n = count_log_pkts(log_file)
+    if n is None:
+        chunks = list(warn_missing_sizes(iter_pkt_chunks(log_file, jobs)))
+        if not chunks:
+            return parse_chunk(b"", 0, 0)
+        return tuple(np.concatenate(column) for column in zip(*chunks))
+    is_client = np.empty(n, bool)
+    times = np.empty(n, np.float64)
+    ids = np.empty(n, "S1")
+    sizes = np.empty(n, np.int64)
+    pos = 0
+    chunks = warn_missing_sizes(iter_pkt_chunks(log_file, jobs))
+    for chunk_client, chunk_times, chunk_ids, chunk_sizes in chunks:
+        end = pos + len(chunk_ids)
+        if chunk_ids.itemsize > ids.itemsize:
+            # widen the id column, usually only for the first chunk
+            ids = ids.astype(chunk_ids.dtype)
+        is_client[pos:end] = chunk_client
+        times[pos:end] = chunk_times
+        ids[pos:end] = chunk_ids
+        sizes[pos:end] = chunk_sizes
+        pos = end
+    return is_client, times, ids, sizes
+
+
+def get_pkt_traces(log_file, jobs=1):
     """
     Extracts packets observed by the middlebox (mid) in both directions from r1.log: timestamp, id, and size.
 
     :param log_file: Path to the log file
+    :param jobs: Number of processes parsing the log
     :return: Lists of packets for the client and server sides
     """
-    client_pkts = []
-    server_pkts = []
-    with open(log_file, "r") as f:
-        for line in f:
-            if line.startswith("[INFO] process pkt"):
-                line = line.strip().split()
-                time = time_from_str(line[3])  # ms
-                id = line[4]
-                if len(line) > 5:
-                    size = int(line[5][:-1])  # remove 'B'. unit: bytes
-                else:
-                    # fake size
-                    print(f"Warning: no size in {line}, using fake size -1")
-                    size = -1
-                if line[2] == "pkt(server)":
-                    server_pkts.append((time, id, size))
-                elif line[2] == "pkt(client)":
-                    client_pkts.append((time, id, size))
-                else:
-                    raise ValueError(f"Unknown pkt type: {line[2]} in {line}")
-    return client_pkts, server_pkts
+    is_client, times, ids, sizes = read_pkts(log_file, jobs)
+    traces = []
+    for mask in (is_client, ~is_client):
+        traces.append(
+            list(
+                zip(
+                    times[mask].tolist(),
+                    map(bytes.decode, ids[mask].tolist()),
+                    sizes[mask].tolist(),
+                )
+            )
+        )
+    return traces[0], traces[1]
+
+
+def write_jsonl(log_file, jsonl_file, jobs=1):
+    """
+    Stream the packets to a JSON Lines file, one {"side", "t", "id", "sz"} object per
+    line, without holding the whole trace in memory.
+    :return: Number of packets for the client and server sides
+    """
+    counts = {"client": 0, "server": 0}
+    with open(jsonl_file, "wb") as out:
+        for side, time, id, size in iter_pkts(log_file, jobs):
+            record = {"side": side, "t": time, "id": id, "sz": size}
+            if orjson is not None:
+                out.write(orjson.dumps(record))
+            else:
+                out.write(json.dumps(record).encode())
+            out.write(b"\n")
+            counts[side] += 1
+    return counts["client"], counts["server"]
+
+
+def write_npz(log_file, npz_file, jobs=1):
+    """
+    Save the packet columns to an .npz file: is_client (bool), times (ms), ids (bytes)
+    and sizes, in log order.
+    :return: Number of packets for the client and server sides
+    """
+    is_client, times, ids, sizes = read_pkts(log_file, jobs)
+    np.savez(npz_file, is_client=is_client, times=times, ids=ids, sizes=sizes)
+    n_client = int(is_client.sum())
+    return n_client, len(is_client) - n_client
 
 
 # main
@@ -48,24 +327,56 @@ if __name__ == "__main__":
     parser.add_argument(
         "--log_file",
         type=str,
-        help="Path to the log file (e.g., ./r1.log)",
+        help="Path to the log file (e.g., ./r1.log or a gzipped ./r1.log.gz)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "jsonl", "msgpack", "npz"],
+        default="json",
+        help="json: one document with client/server lists (default); "
+        "jsonl: stream one packet object per line; "
+        "msgpack: the json document as MessagePack (needs msgpack); "
+        "npz: numpy arrays is_client/times/ids/sizes",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes parsing the log (default: 1)",
     )
     args = parser.parse_args()
+    if args.format == "msgpack" and msgpack is None:
+        parser.error("--format msgpack needs the msgpack package")
 
     log_file = args.log_file
+    # r1.log.gz -> r1.json etc.
+    out_base = log_file[: -len(".gz")] if log_file.endswith(".gz") else log_file
 
-    client_pkts, server_pkts = get_pkt_traces(log_file)
-    print(f"Client packets: {len(client_pkts)}")
-    print(f"Server packets: {len(server_pkts)}")
-    # save to json
-    json_file = log_file.replace(".log", ".json")
-    with open(json_file, "w") as f:
-        json.dump(
-            {
-                "client": client_pkts,
-                "server": server_pkts,
-            },
-            f,
-            indent=4,
-        )
-        print(f"Saved trace: {json_file}")
+    if args.format == "jsonl":
+        out_file = out_base.replace(".log", ".jsonl")
+        n_client, n_server = write_jsonl(log_file, out_file, args.jobs)
+    elif args.format == "npz":
+        out_file = out_base.replace(".log", ".npz")
+        n_client, n_server = write_npz(log_file, out_file, args.jobs)
+    else:
+        client_pkts, server_pkts = get_pkt_traces(log_file, args.jobs)
+        n_client, n_server = len(client_pkts), len(server_pkts)
+        # save to json
+        out_file = out_base.replace(".log", f".{args.format}")
+        trace = {
+            "client": client_pkts,
+            "server": server_pkts,
+        }
+        if args.format == "msgpack":
+            with open(out_file, "wb") as f:
+                msgpack.pack(trace, f)
+        # compact json, without indentation or whitespace
+        elif orjson is not None:
+            with open(out_file, "wb") as f:
+                f.write(orjson.dumps(trace))
+        else:
+            with open(out_file, "w") as f:
+                json.dump(trace, f, separators=(",", ":"))
+    print(f"Client packets: {n_client}")
+    print(f"Server packets: {n_server}")
+    print(f"Saved trace: {out_file}")